@@ -1,14 +1,47 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import base64
+import http.client
+import io
 import json
+import os
 import ssl
-from urllib import request
-from urllib.parse import quote_plus
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.message import Message
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote_plus, urljoin, urlsplit
 
-from typing import Any
+from typing import Any, BinaryIO, Iterator
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 
 GITHUB_API = "https://api.github.com"
+GITHUB_GIT = "https://github.com"
+MAX_REDIRECTS = 5
+HTTP_TIMEOUT = 60
+CLONE_TIMEOUT = 30 * 60
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+SEARCH_MAX_RESULTS = 1000
+SEARCH_PAGE_WORKERS = 5
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_MAX_WAIT = 60
+
+_SSL_CONTEXT = ssl.create_default_context()
+_REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+_RETRY_STATUSES = {502, 503, 504}
+_local = threading.local()
 
 
 def _headers(token: str | None) -> dict[str, str]:
@@ -21,10 +54,124 @@ def _headers(token: str | None) -> dict[str, str]:
     return h
 
 
+def _connection(host: str) -> http.client.HTTPSConnection:
+    pool = getattr(_local, "connections", None)
+    if pool is None:
+        pool = _local.connections = {}
+    conn = pool.get(host)
+    if conn is None:
+        conn = pool[host] = http.client.HTTPSConnection(host, timeout=HTTP_TIMEOUT, context=_SSL_CONTEXT)
+    return conn
+
+
+def _send(
+    url: str, headers: dict[str, str], body: bytes | None = None
+) -> tuple[http.client.HTTPSConnection, http.client.HTTPResponse]:
+    parts = urlsplit(url)
+    method = "GET" if body is None else "POST"
+    target = parts.path or "/"
+    if parts.query:
+        target = f"{target}?{parts.query}"
+
+    conn = _connection(parts.netloc)
+    try:
+        try:
+            conn.request(method, target, body=body, headers=headers)
+            return conn, conn.getresponse()
+        except (ConnectionResetError, BrokenPipeError):
+            # The server may drop an idle keep-alive connection; retry once on a fresh one.
+            conn.close()
+            conn.request(method, target, body=body, headers=headers)
+            return conn, conn.getresponse()
+    except (http.client.HTTPException, OSError) as exc:
+        conn.close()
+        raise URLError(exc) from exc
+
+
+def _send_with_retries(
+    url: str, headers: dict[str, str], body: bytes | None = None
+) -> tuple[http.client.HTTPSConnection, http.client.HTTPResponse]:
+    # Connection failures and gateway errors are usually transient on GitHub's
+    # side; retry them with exponential backoff before surfacing the error.
+    attempt = 0
+    while True:
+        try:
+            conn, resp = _send(url, headers, body)
+        except URLError:
+            if attempt >= RETRY_TOTAL:
+                raise
+        else:
+            if resp.status not in _RETRY_STATUSES or attempt >= RETRY_TOTAL:
+                return conn, resp
+            resp.read()
+        time.sleep(RETRY_BACKOFF * 2**attempt)
+        attempt += 1
+
+
+@contextmanager
+def _open(
+    url: str,
+    token: str | None,
+    *,
+    extra_headers: dict[str, str] | None = None,
+    body: bytes | None = None,
+) -> Iterator[http.client.HTTPResponse]:
+    headers = _headers(token)
+    if extra_headers:
+        headers.update(extra_headers)
+    for _ in range(MAX_REDIRECTS + 1):
+        conn, resp = _send_with_retries(url, headers, body)
+        location = resp.getheader("Location")
+        if resp.status in _REDIRECT_STATUSES and location:
+            resp.read()
+            url = urljoin(url, location)
+            continue
+        if resp.status >= 400:
+            body = resp.read()
+            raise HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(body))
+
+        try:
+            yield resp
+        finally:
+            if not resp.isclosed():
+                conn.close()
+        return
+    raise URLError(f"too many redirects: {url}")
+
+
+def _rate_limit_delay(exc: HTTPError) -> float | None:
+    """Seconds to wait before retrying a rate-limited request, or None to give up."""
+    if exc.code not in (403, 429) or exc.headers is None:
+        return None
+    try:
+        retry_after = exc.headers.get("Retry-After")
+        if retry_after is not None:
+            delay = float(retry_after)
+        elif exc.headers.get("X-RateLimit-Remaining") == "0":
+            delay = float(exc.headers.get("X-RateLimit-Reset", 0)) - time.time() + 1
+        else:
+            return None
+    except ValueError:
+        return None
+    return max(delay, 1.0) if delay <= RATE_LIMIT_MAX_WAIT else None
+
+
+def _request_json(url: str, token: str | None, body: bytes | None = None) -> tuple[Any, Message]:
+    attempt = 0
+    while True:
+        try:
+            with _open(url, token, body=body) as resp:
+                return _loads(resp.read()), resp.headers
+        except HTTPError as exc:
+            delay = _rate_limit_delay(exc)
+            if delay is None or attempt >= RATE_LIMIT_RETRIES:
+                raise
+        attempt += 1
+        time.sleep(delay)
+
+
 def request_json(url: str, token: str | None = None) -> Any:
-    req = request.Request(url, headers=_headers(token))
-    with request.urlopen(req, context=ssl.create_default_context()) as resp:
-        return json.loads(resp.read().decode("utf-8", errors="replace"))
+    return _request_json(url, token)[0]
 
 
 def _build_search_url(query: str, *, sort: str, order: str, per_page: int, page: int) -> str:
@@ -35,35 +182,113 @@ def _build_search_url(query: str, *, sort: str, order: str, per_page: int, page:
     )
 
 
+def _remaining_requests(headers: Message) -> int | None:
+    try:
+        return int(headers["X-RateLimit-Remaining"])
+    except (TypeError, ValueError):
+        return None
+
+
 def fetch_top_repositories(query: str, top_n: int, token: str | None = None) -> tuple[list[dict], int]:
-    requested = max(1, min(top_n, 1000))
-    repos: list[dict] = []
-    page = 1
-    total_count = 0
+    requested = max(1, min(top_n, SEARCH_MAX_RESULTS))
+    # A fixed page size keeps page offsets aligned; the last page is trimmed below.
+    per_page = min(100, requested)
 
-    while len(repos) < requested:
-        remain = requested - len(repos)
-        per_page = min(100, remain)
+    def search_page(page: int) -> tuple[dict, Message]:
         url = _build_search_url(query, sort="stars", order="desc", per_page=per_page, page=page)
-        response = request_json(url, token=token)
+        return _request_json(url, token)
 
-        if not total_count:
-            total_count = int(response.get("total_count", 0))
+    first, headers = search_page(1)
+    total_count = int(first.get("total_count", 0))
+    pages = [first.get("items", [])]
 
-        items = response.get("items", [])
-        if not items:
-            break
+    # The page count is known once page 1 reports total_count, so the rest are
+    # fetched concurrently -- serially if the rate limit can't cover them all.
+    page_count = -(-min(requested, total_count) // per_page)
+    if page_count > 1 and len(pages[0]) == per_page:
+        rest = range(2, page_count + 1)
+        remaining = _remaining_requests(headers)
+        workers = SEARCH_PAGE_WORKERS if remaining is None or remaining >= len(rest) else 1
+        with ThreadPoolExecutor(max_workers=min(workers, len(rest))) as pool:
+            pages.extend(response.get("items", []) for response, _ in pool.map(search_page, rest))
 
-        repos.extend(items)
-        if len(items) < per_page:
-            break
-        if page * 100 >= 1000:
-            break
-        if len(repos) >= total_count:
-            break
+    # Results can shift between pages while they are being fetched; keep each
+    # repository's first occurrence only.
+    repos: list[dict] = []
+    seen: set = set()
+    for items in pages:
+        for item in items:
+            key = item.get("id", item.get("full_name"))
+            if key not in seen:
+                seen.add(key)
+                repos.append(item)
+    return repos[:requested], total_count
 
-        page += 1
 
+_SEARCH_GQL = """
+query($q: String!, $first: Int!, $after: String) {
+  search(type: REPOSITORY, query: $q, first: $first, after: $after) {
+    repositoryCount
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      ... on Repository {
+        databaseId nameWithOwner url stargazerCount diskUsage pushedAt
+        defaultBranchRef { name target { oid } }
+      }
+    }
+  }
+}
+"""
+
+
+def _repo_from_node(node: dict) -> dict:
+    # Same keys as a REST search item, plus the default branch's head commit.
+    branch = node.get("defaultBranchRef") or {}
+    return {
+        "id": node.get("databaseId"),
+        "full_name": node["nameWithOwner"],
+        "html_url": node.get("url", ""),
+        "stargazers_count": node.get("stargazerCount", 0),
+        "size": node.get("diskUsage") or 0,
+        "pushed_at": node.get("pushedAt"),
+        "default_branch": branch.get("name") or "main",
+        "default_branch_sha": (branch.get("target") or {}).get("oid"),
+    }
+
+
+def fetch_top_repositories_gql(query: str, top_n: int, token: str) -> tuple[list[dict], int]:
+    """Like :func:`fetch_top_repositories`, via GraphQL (which requires a token).
+
+    Each repo also carries ``default_branch_sha``, so callers need no
+    per-repo commit lookup.
+    """
+    requested = max(1, min(top_n, SEARCH_MAX_RESULTS))
+    variables: dict[str, Any] = {"q": f"{query} sort:stars-desc", "after": None}
+    repos: list[dict] = []
+    seen: set = set()
+    total_count = 0
+    while len(repos) < requested:
+        variables["first"] = min(100, requested - len(repos))
+        body = json.dumps({"query": _SEARCH_GQL, "variables": variables}).encode()
+        payload, _ = _request_json(f"{GITHUB_API}/graphql", token, body)
+        search = (payload.get("data") or {}).get("search")
+        if search is None:
+            errors = payload.get("errors") or [{}]
+            raise URLError(f"GraphQL search failed: {errors[0].get('message', 'no data')}")
+
+        total_count = int(search.get("repositoryCount", 0))
+        for node in search.get("nodes") or []:
+            if not node or "nameWithOwner" not in node:
+                continue
+            repo = _repo_from_node(node)
+            key = repo["id"] or repo["full_name"]
+            if key not in seen:
+                seen.add(key)
+                repos.append(repo)
+        page_info = search.get("pageInfo") or {}
+        if not page_info.get("hasNextPage"):
+            break
+        variables["after"] = page_info.get("endCursor")
     return repos[:requested], total_count
 
 
@@ -73,11 +298,53 @@ def repo_zip_url(full_name: str, default_branch: str | None = None) -> str:
     return f"{GITHUB_API}/repos/{owner}/{name}/zipball/{branch}"
 
 
-def download_file(url: str, token: str | None, dest):
-    req = request.Request(url, headers=_headers(token))
-    with request.urlopen(req, context=ssl.create_default_context()) as resp, dest.open("wb") as out:
+def partial_clone(full_name: str, dest: Path, max_file_kb: int, token: str | None = None) -> None:
+    """Shallow-clone ``full_name`` into ``dest`` without checkout, leaving blobs over ``max_file_kb`` on the server."""
+    env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+    if token:
+        # Passed through the environment so the token stays out of argv.
+        basic = base64.b64encode(f"x-access-token:{token}".encode()).decode()
+        env.update(
+            GIT_CONFIG_COUNT="1",
+            GIT_CONFIG_KEY_0="http.extraHeader",
+            GIT_CONFIG_VALUE_0=f"Authorization: Basic {basic}",
+        )
+    cmd = [
+        "git",
+        "-c",
+        "protocol.version=2",
+        # Abort a transfer stalled below 1 KB/s for HTTP_TIMEOUT, like a socket read timeout.
+        "-c",
+        "http.lowSpeedLimit=1000",
+        "-c",
+        f"http.lowSpeedTime={HTTP_TIMEOUT}",
+        "clone",
+        "--quiet",
+        "--depth=1",
+        "--single-branch",
+        "--no-checkout",
+        f"--filter=blob:limit={max_file_kb * 1024 + 1}",
+        f"{GITHUB_GIT}/{full_name}.git",
+        str(dest),
+    ]
+    try:
+        subprocess.run(cmd, env=env, capture_output=True, check=True, timeout=CLONE_TIMEOUT)
+    except subprocess.CalledProcessError as exc:
+        raise URLError(exc.stderr.decode("utf-8", errors="replace").strip()) from exc
+    except subprocess.TimeoutExpired as exc:
+        raise URLError(f"git clone timed out after {CLONE_TIMEOUT}s: {full_name}") from exc
+
+
+def download_file(url: str, token: str | None, dest: BinaryIO) -> None:
+    with _open(url, token) as resp:
         while True:
-            chunk = resp.read(1 << 20)
+            try:
+                chunk = resp.read(1 << 20)
+            except (http.client.HTTPException, OSError) as exc:
+                raise URLError(exc) from exc
             if not chunk:
                 break
-            out.write(chunk)
+            dest.write(chunk)
+        # read(amt) returns b"" rather than raising when the peer closes early.
+        if resp.length:
+            raise URLError(f"connection closed with {resp.length} bytes outstanding: {url}")
@@ -5,6 +5,15 @@ import ast
 import re
 
 from dataclasses import dataclass
+from functools import lru_cache
+
+try:
+    from tree_sitter_languages import get_language, get_parser
+except ImportError:
+    get_language = get_parser = None
+
+# Languages whose tree-sitter parser actually loaded (see EXTRACTOR_VERSION).
+_TREE_SITTER_LOADED: set[str] = set()
 
 
 @dataclass
@@ -15,30 +24,25 @@ class FunctionHit:
     kind: str
 
 
-class PythonFunctionVisitor(ast.NodeVisitor):
-    def __init__(self):
-        self.scope: list[str] = []
-        self.functions: list[FunctionHit] = []
-
-    def _name(self, name: str) -> str:
-        return ".".join(self.scope + [name]) if self.scope else name
-
-    def visit_ClassDef(self, node: ast.ClassDef):
-        self.scope.append(node.name)
-        self.generic_visit(node)
-        self.scope.pop()
+_PYTHON_DEF_KINDS = {
+    ast.FunctionDef: "python_function",
+    ast.AsyncFunctionDef: "python_async_function",
+}
+# Definitions are statements, so only statement lists (including except and
+# case clauses) need walking; expression subtrees are never entered.
+# ast.match_case is new in Python 3.10.
+_PYTHON_BLOCK_NODES = (ast.stmt, ast.excepthandler) + (
+    (ast.match_case,) if hasattr(ast, "match_case") else ()
+)
 
-    def visit_FunctionDef(self, node: ast.FunctionDef):
-        start = node.lineno
-        end = getattr(node, "end_lineno", start) or start
-        self.functions.append(FunctionHit(self._name(node.name), start, end, "python_function"))
-        self.generic_visit(node)
 
-    def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef):
-        start = node.lineno
-        end = getattr(node, "end_lineno", start) or start
-        self.functions.append(FunctionHit(self._name(node.name), start, end, "python_async_function"))
-        self.generic_visit(node)
+def _python_blocks(node: ast.AST) -> list[ast.AST]:
+    children: list[ast.AST] = []
+    for field in node._fields:
+        value = getattr(node, field, None)
+        if isinstance(value, list) and value and isinstance(value[0], _PYTHON_BLOCK_NODES):
+            children.extend(value)
+    return children
 
 
 def extract_python_functions(source: str) -> list[FunctionHit]:
@@ -46,67 +50,174 @@ def extract_python_functions(source: str) -> list[FunctionHit]:
         tree = ast.parse(source)
     except SyntaxError:
         return []
-    visitor = PythonFunctionVisitor()
-    visitor.visit(tree)
-    return visitor.functions
-
-
-JS_PATTERNS = [
-    re.compile(r"^\s*(?:export\s+)?function\s+(?P<name>[A-Za-z_$][\w$]*)\s*\("),
-    re.compile(r"^\s*(?:const|let|var)\s+(?P<name>[A-Za-z_$][\w$]*)\s*=\s*(?:async\s+)?\("),
-    re.compile(r"^\s*(?P<name>[A-Za-z_$][\w$]*)\s*=\s*(?:async\s+)?\([^\)]*\)\s*=>"),
-    re.compile(r"^\s*(?:async\s+)?(?P<name>[A-Za-z_$][\w$]*)\s*\([^\)]*\)\s*\{"),
-]
 
-
-def _regex_functions(source: str, patterns: list[re.Pattern], kind: str) -> list[FunctionHit]:
+    functions: list[FunctionHit] = []
+    stack: list[tuple[ast.AST, str]] = [(node, "") for node in reversed(tree.body)]
+    while stack:
+        node, scope = stack.pop()
+        kind = _PYTHON_DEF_KINDS.get(type(node))
+        if kind is not None:
+            name = f"{scope}.{node.name}" if scope else node.name
+            functions.append(FunctionHit(name, node.lineno, node.end_lineno or node.lineno, kind))
+        elif isinstance(node, ast.ClassDef):
+            scope = f"{scope}.{node.name}" if scope else node.name
+        stack.extend((child, scope) for child in reversed(_python_blocks(node)))
+    return functions
+
+
+def _line_pattern(*alternatives: str) -> re.Pattern:
+    # Each alternative holds exactly one capture group, so ``match.lastindex``
+    # identifies the name regardless of which branch matched.
+    renamed = [alt.replace("(?P<name>", f"(?P<name{i}>") for i, alt in enumerate(alternatives)]
+    return re.compile("|".join(f"(?:{alt})" for alt in renamed), re.MULTILINE)
+
+
+# Patterns run over the whole source with re.MULTILINE, so whitespace and
+# negated classes exclude "\n" to keep every match on a single line.
+JS_PATTERN = _line_pattern(
+    r"^[^\S\n]*(?:export[^\S\n]+)?function[^\S\n]+(?P<name>[A-Za-z_$][\w$]*)[^\S\n]*\(",
+    r"^[^\S\n]*(?:const|let|var)[^\S\n]+(?P<name>[A-Za-z_$][\w$]*)[^\S\n]*=[^\S\n]*(?:async[^\S\n]+)?\(",
+    r"^[^\S\n]*(?P<name>[A-Za-z_$][\w$]*)[^\S\n]*=[^\S\n]*(?:async[^\S\n]+)?\([^\)\n]*\)[^\S\n]*=>",
+    r"^[^\S\n]*(?:async[^\S\n]+)?(?P<name>[A-Za-z_$][\w$]*)[^\S\n]*\([^\)\n]*\)[^\S\n]*\{",
+)
+
+GO_PATTERN = _line_pattern(
+    r"^[^\S\n]*func[^\S\n]+(?:\([^\)\n]+\)[^\S\n]*)?(?P<name>[A-Za-z_][A-Za-z0-9_]*)[^\S\n]*\(",
+)
+
+JAVA_LIKE_PATTERN = _line_pattern(
+    r"^[^\S\n]*(?:public|private|protected|static|final|synchronized|abstract[^\S\n]+)?"
+    r"(?:[A-Za-z_<>,\[\]\.]+[^\S\n]+)+(?P<name>[A-Za-z_][A-Za-z0-9_]*)[^\S\n]*\([^\)\n]*\)[^\S\n]*"
+    r"(?:throws[^\S\n]+[^\{\n]+)?\{",
+)
+
+RUBY_PATTERN = _line_pattern(
+    r"^[^\S\n]*def[^\S\n]+(?P<name>[A-Za-z_]?[A-Za-z0-9_]+(?:\.[A-Za-z_][A-Za-z0-9_]*)?)",
+)
+
+
+def _regex_functions(source: str, pattern: re.Pattern, kind: str) -> list[FunctionHit]:
     out: list[FunctionHit] = []
-    for line_no, line in enumerate(source.splitlines(), start=1):
-        for pattern in patterns:
-            match = pattern.search(line)
-            if match:
-                out.append(FunctionHit(match.group("name"), line_no, 0, kind))
-                break
+    line_no = 1
+    pos = 0
+    for match in pattern.finditer(source):
+        line_no += source.count("\n", pos, match.start())
+        pos = match.start()
+        out.append(FunctionHit(match[match.lastindex], line_no, 0, kind))
     return out
 
 
 def extract_js_functions(source: str) -> list[FunctionHit]:
-    return _regex_functions(source, JS_PATTERNS, "js_function")
+    return _regex_functions(source, JS_PATTERN, "js_function")
 
 
 def extract_go_functions(source: str) -> list[FunctionHit]:
-    pattern = re.compile(r"^\s*func\s+(?:\([^\)]+\)\s*)?(?P<name>[A-Za-z_][A-Za-z0-9_]*)\s*\(")
-    return _regex_functions(source, [pattern], "go_function")
+    return _regex_functions(source, GO_PATTERN, "go_function")
 
 
 def extract_java_like_functions(source: str) -> list[FunctionHit]:
-    pattern = re.compile(
-        r"^\s*(?:public|private|protected|static|final|synchronized|abstract\s+)?"
-        r"(?:[A-Za-z_<>,\[\]\.]+\s+)+(?P<name>[A-Za-z_][A-Za-z0-9_]*)\s*\([^\)]*\)\s*(?:throws\s+[^\{]+)?\{"
-    )
-    return _regex_functions(source, [pattern], "java_like_function")
+    return _regex_functions(source, JAVA_LIKE_PATTERN, "java_like_function")
 
 
 def extract_ruby_functions(source: str) -> list[FunctionHit]:
-    pattern = re.compile(r"^\s*def\s+(?P<name>[A-Za-z_]?[A-Za-z0-9_]+(?:\.[A-Za-z_][A-Za-z0-9_]*)?)")
-    return _regex_functions(source, [pattern], "ruby_method")
+    return _regex_functions(source, RUBY_PATTERN, "ruby_method")
+
+
+_JS_QUERY = """
+(function_declaration) @fn
+(generator_function_declaration) @fn
+(method_definition) @fn
+(variable_declarator value: (arrow_function)) @fn
+(variable_declarator value: (function)) @fn
+(assignment_expression left: (identifier) right: (arrow_function)) @fn
+"""
+
+TREE_SITTER_QUERIES: dict[str, str] = {
+    "javascript": _JS_QUERY,
+    "typescript": _JS_QUERY,
+    "tsx": _JS_QUERY,
+    "go": "(function_declaration) @fn (method_declaration) @fn",
+    "java": "(method_declaration) @fn (constructor_declaration) @fn",
+    "c_sharp": "(method_declaration) @fn (constructor_declaration) @fn",
+    "c": "(function_definition) @fn",
+    "cpp": "(function_definition) @fn",
+    "ruby": "(method) @fn (singleton_method) @fn",
+}
+
+
+def _node_name(node) -> str | None:
+    current = node
+    while True:
+        for field in ("name", "left"):
+            child = current.child_by_field_name(field)
+            if child is not None:
+                name = child.text.decode("utf-8", errors="ignore")
+                owner = current.child_by_field_name("object")
+                if current.type == "singleton_method" and owner is not None:
+                    return f"{owner.text.decode('utf-8', errors='ignore')}.{name}"
+                return name
+        declarator = current.child_by_field_name("declarator")
+        if declarator is None and current is not node and current.type.endswith("_declarator"):
+            # e.g. reference_declarator ("&" + function_declarator) has no field.
+            declarator = next(iter(current.named_children), None)
+        if declarator is None:
+            return None if current is node else current.text.decode("utf-8", errors="ignore")
+        current = declarator
+
+
+@lru_cache(maxsize=None)
+def _tree_sitter_extractor(language_name: str, kind: str, fallback):
+    # Cached so extensions sharing a grammar (cpp, javascript) share one parser.
+    if get_parser is None:
+        return fallback
+    try:
+        parser = get_parser(language_name)
+        query = get_language(language_name).query(TREE_SITTER_QUERIES[language_name])
+    except Exception:
+        return fallback
+    _TREE_SITTER_LOADED.add(language_name)
+
+    def extract(source: str) -> list[FunctionHit]:
+        tree = parser.parse(source.encode("utf-8"))
+        captures = query.captures(tree.root_node)
+        if isinstance(captures, dict):
+            nodes = captures.get("fn", [])
+        else:
+            nodes = [node for node, _ in captures]
+
+        out: list[FunctionHit] = []
+        for node in nodes:
+            name = _node_name(node)
+            if name:
+                out.append(FunctionHit(name, node.start_point[0] + 1, node.end_point[0] + 1, kind))
+        out.sort(key=lambda hit: hit.start_line)
+        return out
+
+    return extract
 
 
 EXTRACTORS: dict[str, callable] = {
     ".py": extract_python_functions,
     ".pyi": extract_python_functions,
-    ".js": extract_js_functions,
-    ".jsx": extract_js_functions,
-    ".ts": extract_js_functions,
-    ".tsx": extract_js_functions,
-    ".go": extract_go_functions,
-    ".java": extract_java_like_functions,
-    ".cs": extract_java_like_functions,
-    ".rb": extract_ruby_functions,
-    ".cpp": extract_java_like_functions,
-    ".c": extract_java_like_functions,
-    ".cc": extract_java_like_functions,
-    ".cxx": extract_java_like_functions,
-    ".h": extract_java_like_functions,
-    ".hpp": extract_java_like_functions,
+    ".js": _tree_sitter_extractor("javascript", "js_function", extract_js_functions),
+    ".jsx": _tree_sitter_extractor("javascript", "js_function", extract_js_functions),
+    ".ts": _tree_sitter_extractor("typescript", "js_function", extract_js_functions),
+    ".tsx": _tree_sitter_extractor("tsx", "js_function", extract_js_functions),
+    ".go": _tree_sitter_extractor("go", "go_function", extract_go_functions),
+    ".java": _tree_sitter_extractor("java", "java_like_function", extract_java_like_functions),
+    ".cs": _tree_sitter_extractor("c_sharp", "java_like_function", extract_java_like_functions),
+    ".rb": _tree_sitter_extractor("ruby", "ruby_method", extract_ruby_functions),
+    ".cpp": _tree_sitter_extractor("cpp", "java_like_function", extract_java_like_functions),
+    ".c": _tree_sitter_extractor("c", "java_like_function", extract_java_like_functions),
+    ".cc": _tree_sitter_extractor("cpp", "java_like_function", extract_java_like_functions),
+    ".cxx": _tree_sitter_extractor("cpp", "java_like_function", extract_java_like_functions),
+    ".h": _tree_sitter_extractor("cpp", "java_like_function", extract_java_like_functions),
+    ".hpp": _tree_sitter_extractor("cpp", "java_like_function", extract_java_like_functions),
 }
+
+# Bump the number whenever extractor output changes so on-disk caches are
+# invalidated; the suffix records which languages really used tree-sitter, so
+# a broken tree-sitter install never shares cache entries with a working one.
+EXTRACTOR_VERSION = "2"
+if _TREE_SITTER_LOADED:
+    EXTRACTOR_VERSION += "+tree-sitter:" + ",".join(sorted(_TREE_SITTER_LOADED))
@@ -1,12 +1,34 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+import re
+import subprocess
 import tempfile
+import threading
 import zipfile
+import zlib
+from bisect import bisect_left
+from dataclasses import asdict, dataclass
+from typing import BinaryIO, Collection, Iterator
 from pathlib import Path
 
 import gf_extractors
 
+try:
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None
+
+EXTRACT_CACHE_DIR = Path.home() / ".cache" / "gf"
+
+BINARY_SNIFF_BYTES = 4096
+MINIFIED_MIN_BYTES = 100 * 1024
+MINIFIED_LINE_LENGTH = 1000
+MEMO_MAX_ENTRIES = 50_000
+
 SKIP_DIRS = {
     ".git",
     "node_modules",
@@ -18,117 +40,442 @@ SKIP_DIRS = {
     "__pycache__",
     ".idea",
     ".vscode",
+    "vendored",
+    "third_party",
+    "generated",
+    "__generated__",
+    "testdata",
+    "fixtures",
 }
 
 
-def should_skip(path: Path) -> bool:
-    return any(part in SKIP_DIRS for part in path.parts)
+def _get_decompressor(compress_type: int):
+    # ISA-L inflates DEFLATE members (nearly all of a zipball) 2-3x faster than zlib.
+    if compress_type == zipfile.ZIP_DEFLATED:
+        return isal_zlib.decompressobj(-15)
+    return _stdlib_get_decompressor(compress_type)
+
+
+if isal_zlib is not None:
+    _stdlib_get_decompressor = zipfile._get_decompressor
+    zipfile._get_decompressor = _get_decompressor
+
+# What reading a corrupt, truncated or since-removed archive can raise.
+ARCHIVE_ERRORS: tuple[type[Exception], ...] = (
+    zipfile.BadZipFile,
+    zlib.error,
+    OSError,
+    EOFError,
+    NotImplementedError,
+)
+if isal_zlib is not None:
+    ARCHIVE_ERRORS += (isal_zlib.error,)
+
+
+def should_skip(rel: str) -> bool:
+    return not SKIP_DIRS.isdisjoint(rel.split("/"))
+
+
+def file_extension(rel: str) -> str:
+    name = rel.rpartition("/")[2]
+    dot = name.rfind(".")
+    return name[dot:].lower() if 0 < dot < len(name) - 1 else ""
+
+
+def is_binary_or_minified(source_bytes: bytes) -> bool:
+    if b"\x00" in source_bytes[:BINARY_SNIFF_BYTES]:
+        return True
+    if len(source_bytes) <= MINIFIED_MIN_BYTES:
+        return False
+    return len(source_bytes) / (source_bytes.count(b"\n") + 1) > MINIFIED_LINE_LENGTH
+
+
+def top_dir_prefix(names: list[str]) -> str:
+    readme_dirs = [name[: -len("README.md")] for name in names if name.endswith("/README.md")]
+    if readme_dirs:
+        return min(readme_dirs, key=len)
+    first_dir = next((name.split("/", 1)[0] for name in names if "/" in name), None)
+    return f"{first_dir}/" if first_dir else ""
+
+
+_RUBY_BLOCK_RE = re.compile(r"^[^\S\n]*(?:(def )|end)", re.MULTILINE)
+
+
+@dataclass
+class BlockIndex:
+    open_lines: list[int]
+    close_lines: list[int]
+    line_count: int
+    unopened_is_start: bool
+
+    def end_line(self, start_line: int) -> int:
+        i = bisect_left(self.open_lines, start_line)
+        if i == len(self.open_lines):
+            return start_line if self.unopened_is_start else self.line_count
+        return self.close_lines[i] or self.line_count
+
+
+def _match_blocks(events: Iterator[tuple[int, bool]]) -> tuple[list[int], list[int]]:
+    open_lines: list[int] = []
+    close_lines: list[int] = []
+    stack: list[int] = []
+    for line_no, is_open in events:
+        if is_open:
+            stack.append(len(open_lines))
+            open_lines.append(line_no)
+            close_lines.append(0)
+        elif stack:
+            close_lines[stack.pop()] = line_no
+    return open_lines, close_lines
+
+
+def _brace_events(source: str) -> Iterator[tuple[int, bool]]:
+    # Hop between braces with str.find and count the newlines skipped over;
+    # both run in C, so Python only sees one iteration per brace.
+    find = source.find
+    count = source.count
+    line_no = 1
+    pos = 0
+    next_open = find("{")
+    next_close = find("}")
+    while next_close >= 0 or next_open >= 0:
+        is_open = next_open >= 0 and (next_close < 0 or next_open < next_close)
+        hit = next_open if is_open else next_close
+        line_no += count("\n", pos, hit)
+        pos = hit
+        yield line_no, is_open
+        if is_open:
+            next_open = find("{", hit + 1)
+        else:
+            next_close = find("}", hit + 1)
+
+
+def _ruby_events(source: str) -> Iterator[tuple[int, bool]]:
+    line_no = 1
+    pos = 0
+    for match in _RUBY_BLOCK_RE.finditer(source):
+        line_no += source.count("\n", pos, match.start())
+        pos = match.start()
+        yield line_no, match.group(1) is not None
+
+
+def build_block_index(extension: str, source: str) -> BlockIndex:
+    events = _ruby_events(source) if extension == ".rb" else _brace_events(source)
+    open_lines, close_lines = _match_blocks(events)
+    line_count = source.count("\n") + (not source.endswith("\n"))
+    return BlockIndex(open_lines, close_lines, line_count, unopened_is_start=extension != ".rb")
+
+
+def line_offsets(source: str) -> list[int]:
+    """Start offset of every line, plus a sentinel one past the final line's end."""
+    offsets = [0]
+    pos = source.find("\n")
+    while pos >= 0:
+        offsets.append(pos + 1)
+        pos = source.find("\n", pos + 1)
+    if not source.endswith("\n"):
+        offsets.append(len(source) + 1)
+    return offsets
+
+
+def line_span(source: str, offsets: list[int], start_line: int, end_line: int) -> str:
+    end_line = min(end_line, len(offsets) - 1)
+    if start_line > end_line:
+        return ""
+    text = source[offsets[start_line - 1] : offsets[end_line] - 1]
+    if "\r" in text:
+        text = "\n".join(text.splitlines())
+    return text
+
+
+_memo: dict[tuple[str, bytes], tuple[gf_extractors.FunctionHit, ...]] = {}
+_memo_lock = threading.Lock()
+
+
+def _cache_path(cache_dir: Path, source_bytes: bytes, extension: str) -> Path:
+    digest = hashlib.sha256(source_bytes)
+    digest.update(f"\0{extension}\0{gf_extractors.EXTRACTOR_VERSION}".encode())
+    key = digest.hexdigest()
+    return cache_dir / key[:2] / f"extract-{key}.json"
+
+
+# Matches every entry written by _cache_path, relative to the cache dir.
+EXTRACT_CACHE_GLOB = "??/extract-*.json"
+
+
+def _load_cached_hits(path: Path) -> list[gf_extractors.FunctionHit] | None:
+    try:
+        with path.open("rb") as fh:
+            raw = json.load(fh)
+        os.utime(path)
+        return [gf_extractors.FunctionHit(**item) for item in raw]
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _store_cached_hits(path: Path, hits: list[gf_extractors.FunctionHit]) -> None:
+    tmp_name = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump([asdict(hit) for hit in hits], fh)
+        os.replace(tmp_name, path)
+    except OSError:
+        if tmp_name:
+            Path(tmp_name).unlink(missing_ok=True)
+
+
+def _memo_get(key: tuple[str, bytes]) -> list[gf_extractors.FunctionHit] | None:
+    with _memo_lock:
+        hits = _memo.get(key)
+    return list(hits) if hits is not None else None
+
+
+def _memo_put(key: tuple[str, bytes], hits: list[gf_extractors.FunctionHit]) -> None:
+    with _memo_lock:
+        if len(_memo) >= MEMO_MAX_ENTRIES:
+            _memo.pop(next(iter(_memo)))
+        _memo[key] = tuple(hits)
 
 
-def find_brace_block_end(lines: list[str], start_line: int) -> int:
-    depth = 0
-    seen_open = False
+def extract_cached(
+    extractor,
+    source: str,
+    source_bytes: bytes,
+    extension: str,
+    cache_dir: Path | None,
+) -> list[gf_extractors.FunctionHit]:
+    # Forks and vendored copies repeat files across repos, so identical sources
+    # are served from this process's memo before touching the disk cache.
+    memo_key = (extension, hashlib.blake2b(source_bytes, digest_size=16).digest())
+    hits = _memo_get(memo_key)
+    if hits is not None:
+        return hits
 
-    for i in range(start_line - 1, len(lines)):
-        line = lines[i]
-        for ch in line:
-            if ch == "{":
-                depth += 1
-                seen_open = True
-            elif ch == "}" and depth > 0:
-                depth -= 1
-                if depth == 0:
-                    return i + 1
+    if cache_dir is None:
+        hits = extractor(source)
+    else:
+        path = _cache_path(cache_dir, source_bytes, extension)
+        hits = _load_cached_hits(path)
+        if hits is None:
+            hits = extractor(source)
+            _store_cached_hits(path, hits)
 
-    return len(lines) if seen_open else start_line
+    _memo_put(memo_key, hits)
+    return hits
 
 
-def find_ruby_end_line(lines: list[str], start_line: int) -> int:
-    depth = 0
-    for i in range(start_line - 1, len(lines)):
-        line = lines[i]
-        stripped = line.strip()
-        if not stripped or stripped.startswith("#"):
+def _extractors(extensions: Collection[str] | None) -> dict[str, object]:
+    if extensions is None:
+        return gf_extractors.EXTRACTORS
+    return {ext: fn for ext, fn in gf_extractors.EXTRACTORS.items() if ext in extensions}
+
+
+def _iter_candidates(
+    zf: zipfile.ZipFile,
+    max_file_kb: int,
+    extensions: Collection[str] | None = None,
+) -> Iterator[tuple[zipfile.ZipInfo, str, str, object]]:
+    infos = zf.infolist()
+    prefix = top_dir_prefix([info.filename for info in infos])
+    prefix_len = len(prefix)
+    max_bytes = max_file_kb * 1024
+    extractors = _extractors(extensions)
+
+    for info in infos:
+        filename = info.filename
+        if not filename.startswith(prefix) or filename.endswith("/"):
+            continue
+
+        rel = filename[prefix_len:]
+        extension = file_extension(rel)
+        extractor = extractors.get(extension)
+        if extractor is None or info.file_size > max_bytes or should_skip(rel):
             continue
+        yield info, rel, extension, extractor
+
+
+def candidate_members(
+    zip_file: Path | BinaryIO,
+    max_file_kb: int,
+    extensions: Collection[str] | None = None,
+) -> list[str]:
+    with zipfile.ZipFile(zip_file) as zf:
+        return [info.filename for info, *_ in _iter_candidates(zf, max_file_kb, extensions)]
+
+
+def _scan_source(
+    source_bytes: bytes,
+    rel: str,
+    extension: str,
+    extractor,
+    repo_id: str,
+    collect_body: bool,
+    cache_dir: Path | None,
+) -> list[dict]:
+    if is_binary_or_minified(source_bytes):
+        return []
+    source = source_bytes.decode("utf-8", errors="ignore")
 
-        if stripped.startswith("def "):
-            depth += 1
-        if stripped == "end" or stripped.startswith("end"):
-            if depth > 0:
-                depth -= 1
-                if depth == 0:
-                    return i + 1
-    return len(lines)
+    try:
+        extracted_funcs = extract_cached(extractor, source, source_bytes, extension, cache_dir)
+    except Exception:
+        return []
 
+    funcs: list[dict] = []
+    block_index = None
+    offsets = None
+    for hit in extracted_funcs:
+        actual_end = hit.end_line
+        if not actual_end:
+            if block_index is None:
+                block_index = build_block_index(extension, source)
+            actual_end = block_index.end_line(hit.start_line)
 
-def infer_end_line(extension: str, lines: list[str], start_line: int) -> int:
-    if extension == ".rb":
-        return find_ruby_end_line(lines, start_line)
-    return find_brace_block_end(lines, start_line)
+        if actual_end < hit.start_line:
+            actual_end = hit.start_line
+        record: dict[str, object] = {
+            "repo": repo_id,
+            "path": rel,
+            "name": hit.name,
+            "start_line": hit.start_line,
+            "end_line": actual_end,
+            "kind": hit.kind,
+            "extension": extension,
+        }
+        if collect_body:
+            if offsets is None:
+                offsets = line_offsets(source)
+            body = line_span(source, offsets, hit.start_line, actual_end)
+            if body:
+                record["body"] = body
+        funcs.append(record)
+    return funcs
 
 
 def scan_zip_archive(
-    zip_path: Path,
+    zip_file: Path | BinaryIO,
     repo_id: str,
     max_file_kb: int,
     *,
     collect_body: bool = False,
+    cache_dir: Path | None = None,
+    members: Collection[str] | None = None,
+    extensions: Collection[str] | None = None,
 ) -> list[dict]:
     funcs: list[dict] = []
+    wanted = set(members) if members is not None else None
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        root = Path(tmpdir)
-        with zipfile.ZipFile(zip_path) as zf:
-            zf.extractall(root)
-
-        extracted = [p for p in root.rglob("*") if p.is_dir()]
-        top_dir = next((p for p in extracted if (p / "README.md").exists()), None)
-        if top_dir is None:
-            top_dir = extracted[0] if extracted else root
-
-        for file_path in top_dir.rglob("*"):
-            if file_path.is_dir() or should_skip(file_path.relative_to(top_dir)):
-                continue
-
-            rel = file_path.relative_to(top_dir)
-            extension = file_path.suffix.lower()
-            extractor = gf_extractors.EXTRACTORS.get(extension)
-            if not extractor:
+    with zipfile.ZipFile(zip_file) as zf:
+        for info, rel, extension, extractor in _iter_candidates(zf, max_file_kb, extensions):
+            if wanted is not None and info.filename not in wanted:
                 continue
 
             try:
-                if file_path.stat().st_size > max_file_kb * 1024:
-                    continue
-                source = file_path.read_text(encoding="utf-8", errors="ignore")
-            except OSError:
+                with zf.open(info) as fh:
+                    source_bytes = fh.read()
+            except (OSError, zipfile.BadZipFile):
                 continue
+            funcs.extend(_scan_source(source_bytes, rel, extension, extractor, repo_id, collect_body, cache_dir))
+
+    return funcs
+
 
+def _git_env() -> dict[str, str]:
+    # Never fetch filtered-out blobs on demand (honoured by git 2.45+; older
+    # versions rely on the candidates below excluding missing objects).
+    return dict(os.environ, GIT_NO_LAZY_FETCH="1")
+
+
+def _git(repo_dir: Path, *args: str) -> bytes:
+    cmd = ["git", "-C", str(repo_dir), *args]
+    return subprocess.run(cmd, capture_output=True, check=True, env=_git_env()).stdout
+
+
+def _iter_git_blobs(repo_dir: Path, oids: list[bytes]) -> Iterator[bytes | None]:
+    """Yield each object's contents in order (None if missing) from one ``git cat-file --batch``.
+
+    Blobs are read off the pipe one at a time, so only the current file is
+    held in memory; object ids are fed from a thread so neither pipe can
+    fill up and stall git.
+    """
+    cmd = ["git", "-C", str(repo_dir), "cat-file", "--batch"]
+    with subprocess.Popen(
+        cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=_git_env()
+    ) as proc:
+
+        def feed() -> None:
             try:
-                extracted_funcs = extractor(source)
-            except Exception:
+                proc.stdin.writelines(oid + b"\n" for oid in oids)
+                proc.stdin.close()
+            except (BrokenPipeError, ValueError):
+                pass
+
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+        for _ in oids:
+            header = proc.stdout.readline().split()
+            if not header:
+                break
+            if len(header) != 3:
+                yield None
                 continue
+            size = int(header[2])
+            data = proc.stdout.read(size)
+            proc.stdout.read(1)
+            if len(data) != size:
+                break
+            yield data
+        writer.join()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def _iter_git_candidates(
+    repo_dir: Path,
+    extensions: Collection[str] | None = None,
+) -> Iterator[tuple[bytes, str, str, object]]:
+    listing = _git(repo_dir, "rev-list", "--objects", "--missing=print", "HEAD")
+    missing = {line[1:] for line in listing.splitlines() if line.startswith(b"?")}
+    extractors = _extractors(extensions)
+
+    for entry in _git(repo_dir, "ls-tree", "-r", "-z", "HEAD").split(b"\0"):
+        meta, _, path = entry.partition(b"\t")
+        if not path:
+            continue
+        mode, kind, oid = meta.split()
+        if kind != b"blob" or mode == b"120000" or oid in missing:
+            continue
+
+        rel = path.decode("utf-8", errors="replace")
+        extension = file_extension(rel)
+        extractor = extractors.get(extension)
+        if extractor is None or should_skip(rel):
+            continue
+        yield oid, rel, extension, extractor
 
-            lines = source.splitlines()
-            for hit in extracted_funcs:
-                actual_end = hit.end_line
-                if extension not in {".py", ".pyi"}:
-                    actual_end = infer_end_line(extension, lines, hit.start_line)
-
-                if actual_end < hit.start_line:
-                    actual_end = hit.start_line
-                record: dict[str, object] = {
-                    "repo": repo_id,
-                    "path": str(rel).replace("\\", "/"),
-                    "name": hit.name,
-                    "start_line": hit.start_line,
-                    "end_line": actual_end,
-                    "kind": hit.kind,
-                    "extension": extension,
-                }
-                if collect_body:
-                    body = "\n".join(lines[hit.start_line - 1 : actual_end])
-                    if body:
-                        record["body"] = body
-                funcs.append(record)
+
+def scan_git_repo(
+    repo_dir: Path,
+    repo_id: str,
+    max_file_kb: int,
+    *,
+    collect_body: bool = False,
+    cache_dir: Path | None = None,
+    extensions: Collection[str] | None = None,
+) -> list[dict]:
+    """Scan HEAD of a (possibly partial, checkout-less) clone straight from its object store."""
+    candidates = list(_iter_git_candidates(repo_dir, extensions))
+    if not candidates:
+        return []
+
+    blobs = _iter_git_blobs(repo_dir, [oid for oid, *_ in candidates])
+    max_bytes = max_file_kb * 1024
+    funcs: list[dict] = []
+    # blobs comes first so it is run to completion and git's exit status checked.
+    for source_bytes, (_, rel, extension, extractor) in zip(blobs, candidates):
+        if source_bytes is not None and len(source_bytes) <= max_bytes:
+            funcs.extend(_scan_source(source_bytes, rel, extension, extractor, repo_id, collect_body, cache_dir))
 
     return funcs
@@ -7,21 +7,66 @@ Prints matches as soon as each repository finishes scanning.
 from __future__ import annotations
 
 import argparse
+import hashlib
+import io
+import json
+import multiprocessing
 import os
 import shlex
+import shutil
 import subprocess
 import sys
-import zipfile
+import tempfile
+import threading
+from bisect import bisect_right
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from dataclasses import dataclass
+from itertools import islice
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO, Iterator
 from urllib.error import HTTPError, URLError
 
 import gf_client
+import gf_extractors
 import gf_scanner
 
+try:
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+try:
+    import xxhash
+
+    def _body_key(body: str) -> int:
+        return xxhash.xxh3_64_intdigest(body.encode())
+
+except ImportError:
+
+    def _body_key(body: str) -> int:
+        return int.from_bytes(hashlib.blake2b(body.encode(), digest_size=8).digest(), "big")
+
+
+SPLIT_SCAN_MIN_FILES = 200
+DOWNLOAD_WORKERS = 30
+ARCHIVE_SLACK = 4
+ZIP_CACHE_MAX_BYTES = 4 << 30
+RESULTS_CACHE_MAX_BYTES = 1 << 30
+EXTRACT_CACHE_MAX_BYTES = 1 << 30
+SPOOL_MAX_BYTES = 32 << 20
+
+_zip_cache_lock = threading.Lock()
+
 
 @dataclass
 class RepoResult:
@@ -32,6 +77,15 @@ class RepoResult:
     functions: list[dict]
 
 
+@dataclass
+class _Fetched:
+    archive: bytes | Path | None = None
+    is_temp: bool = False
+    functions: list[dict] | None = None
+    results_path: Path | None = None
+    zip_cache_path: Path | None = None
+
+
 def _parse_batch_targets(raw: str | None, final_top: int) -> list[int]:
     if not raw:
         return [final_top]
@@ -93,8 +147,10 @@ def _build_common_argv(args: argparse.Namespace) -> list[str]:
         str(args.top),
         "--max-file-kb",
         str(args.max_file_kb),
-        "--workers",
-        str(args.workers),
+        "--download-workers",
+        str(args.download_workers),
+        "--scan-workers",
+        str(args.scan_workers),
         "--workdir",
         args.workdir,
         "--chunk-size",
@@ -105,10 +161,22 @@ def _build_common_argv(args: argparse.Namespace) -> list[str]:
         argv.extend(["--token", args.token])
     if args.show_body:
         argv.append("--show-body")
+    if args.json:
+        argv.append("--json")
     if args.no_body:
         argv.append("--no-body")
     if args.keep_zips:
         argv.append("--keep-zips")
+    if args.git_clone:
+        argv.append("--git-clone")
+    if args.extensions:
+        argv.extend(["--extensions", args.extensions])
+    if args.no_dedup:
+        argv.append("--no-dedup")
+    if args.no_cache:
+        argv.append("--no-cache")
+    else:
+        argv.extend(["--cache-dir", args.cache_dir])
 
     return argv
 
@@ -163,9 +231,10 @@ def _run_subset(args: argparse.Namespace) -> tuple[int, int]:
     requested_top = max(1, min(args.top, 100))
     workdir = Path(args.workdir)
     zip_dir = workdir / "repo.zip"
-    zip_dir.mkdir(parents=True, exist_ok=True)
+    if args.keep_zips:
+        zip_dir.mkdir(parents=True, exist_ok=True)
 
-    repos, _ = gf_client.fetch_top_repositories(args.query, requested_top, token=args.token)
+    repos, _ = _fetch_top_repositories(args, requested_top)
     if not repos:
         return 0, 0
 
@@ -175,7 +244,7 @@ def _run_subset(args: argparse.Namespace) -> tuple[int, int]:
         return 0, 0
 
     if getattr(args, "batch_label", None):
-        print(f"[batch {args.batch_label}] repos {start + 1}-{end}")
+        _status(args, f"[batch {args.batch_label}] repos {start + 1}-{end}")
 
     repositories, functions = _process_repositories(
         repos,
@@ -185,51 +254,398 @@ def _run_subset(args: argparse.Namespace) -> tuple[int, int]:
         zip_dir,
         args,
     )
-    print(f"[batch {args.batch_label} done] Printed {functions} functions across {repositories} repos.")
+    _prune_caches(args)
+    _status(args, f"[batch {args.batch_label} done] Printed {functions} functions across {repositories} repos.")
     return repositories, functions
 
 
-def _print_functions(repo: str, functions: list[dict], show_body: bool) -> None:
+class _ZipSpool:
+    """Download sink that buffers in memory and spills to a named temp file.
+
+    Archives up to SPOOL_MAX_BYTES are handed to scan workers as bytes; larger
+    ones go by path so they are neither held in memory nor pickled once per
+    scan chunk.
+    """
+
+    def __init__(self, scratch: Path) -> None:
+        self._scratch = scratch
+        self._buf: io.BytesIO | None = io.BytesIO()
+        self._file: BinaryIO | None = None
+        self.path: Path | None = None
+
+    def write(self, chunk: bytes) -> int:
+        if self._buf is not None and self._buf.tell() + len(chunk) > SPOOL_MAX_BYTES:
+            fd, name = tempfile.mkstemp(suffix=".zip", dir=self._scratch)
+            self.path = Path(name)
+            self._file = os.fdopen(fd, "wb")
+            self._file.write(self._buf.getbuffer())
+            self._buf = None
+        if self._file is not None:
+            return self._file.write(chunk)
+        return self._buf.write(chunk)
+
+    def finish(self) -> bytes | Path:
+        if self._file is None:
+            return self._buf.getvalue()
+        self._file.close()
+        return self.path
+
+    def discard(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self.path.unlink(missing_ok=True)
+
+
+def _archive_file(archive: bytes | Path) -> Path | BinaryIO:
+    return io.BytesIO(archive) if isinstance(archive, bytes) else archive
+
+
+def _discard_archive(archive: bytes | Path, is_temp: bool) -> None:
+    if not is_temp:
+        return
+    if archive.is_dir():
+        shutil.rmtree(archive, ignore_errors=True)
+    else:
+        archive.unlink(missing_ok=True)
+
+
+def _status(args: argparse.Namespace, message: str) -> None:
+    # Progress lines go to stderr in --json mode so stdout stays pure NDJSON.
+    print(message, file=sys.stderr if args.json else sys.stdout)
+
+
+def _duplicate_of(
+    repo: str, fn: dict, seen: dict[int, tuple[str, str, int, str]] | None
+) -> tuple[str, str, int, str] | None:
+    """``(repo, path, start_line, name)`` that first printed this function's body, recording it if new."""
+    body = fn.get("body")
+    if seen is None or not isinstance(body, str) or not body.strip():
+        return None
+    key = _body_key(body)
+    first = seen.get(key)
+    if first is None:
+        seen[key] = (repo, fn["path"], int(fn["start_line"]), fn["name"])
+    return first
+
+
+def _print_functions(
+    repo: str,
+    functions: list[dict],
+    show_body: bool,
+    as_json: bool = False,
+    seen: dict[int, tuple[str, str, int, str]] | None = None,
+) -> None:
+    """Print ``functions``; bodies already in ``seen`` are replaced by a pointer to their first copy."""
+    if not functions:
+        return
+    if as_json:
+        out = []
+        for fn in functions:
+            first = _duplicate_of(repo, fn, seen)
+            if first is not None:
+                fn = {key: value for key, value in fn.items() if key != "body"}
+                fn["duplicate_of"] = dict(zip(("repo", "path", "start_line", "name"), first))
+            out.append(f"{_dumps(fn)}\n")
+        sys.stdout.write("".join(out))
+        return
+
+    # One write per repo instead of up to three prints per function.
+    lines = []
     for fn in functions:
         start = int(fn["start_line"])
         end = max(start, int(fn["end_line"]))
-        print(f"[{repo}] {fn['path']} start:{start} end:{end} {fn['kind']} {fn['name']}")
-        if show_body:
-            body = fn.get("body")
-            if isinstance(body, str) and body.strip():
-                print(body)
-        print("-" * 80)
+        header = f"[{repo}] {fn['path']} start:{start} end:{end} {fn['kind']} {fn['name']}"
+        first = _duplicate_of(repo, fn, seen) if show_body else None
+        if first is not None:
+            lines.append(f"{header} DUPLICATE of [{first[0]}] {first[1]} start:{first[2]} {first[3]}")
+        else:
+            lines.append(header)
+            if show_body:
+                body = fn.get("body")
+                if isinstance(body, str) and body.strip():
+                    lines.append(body)
+        lines.append("-" * 80)
+    lines.append("")
+    sys.stdout.write("\n".join(lines))
 
 
-def _scan_repository(
-    idx: int,
+def _repo_zip_path(repo: dict, zip_dir: Path) -> Path:
+    return zip_dir / f"{repo['full_name'].replace('/', '__')}.zip"
+
+
+def _read_cached_zip(path: Path) -> bytes | Path | None:
+    try:
+        size = path.stat().st_size
+        os.utime(path)
+        return path.read_bytes() if size <= SPOOL_MAX_BYTES else path
+    except OSError:
+        return None
+
+
+def _write_archive(archive: bytes | Path, path: Path) -> None:
+    if isinstance(archive, bytes):
+        path.write_bytes(archive)
+    else:
+        shutil.copyfile(archive, path)
+
+
+def _replace_file(path: Path, data: bytes | Path) -> bool:
+    """Atomically write ``data`` (bytes, or a file to copy) to ``path``; False if that failed."""
+    tmp_name = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            if isinstance(data, bytes):
+                fh.write(data)
+            else:
+                with data.open("rb") as src:
+                    shutil.copyfileobj(src, fh, 1 << 20)
+        os.replace(tmp_name, path)
+        return True
+    except OSError:
+        if tmp_name:
+            Path(tmp_name).unlink(missing_ok=True)
+        return False
+
+
+def _store_cached_zip(path: Path, archive: bytes | Path) -> None:
+    if _replace_file(path, archive):
+        # Download threads store concurrently; prune one at a time.
+        with _zip_cache_lock:
+            _prune_cache(path.parent, "*.zip", ZIP_CACHE_MAX_BYTES)
+
+
+def _prune_cache(cache_dir: Path, pattern: str, max_bytes: int) -> None:
+    """Delete the least recently used files matching ``pattern`` until the rest fit in ``max_bytes``."""
+    # Entries removed while scanning (by another batch process) are skipped.
+    entries = []
+    for path in cache_dir.glob(pattern):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def _prune_caches(args: argparse.Namespace) -> None:
+    # ZIPs are pruned as they are stored; the many small extraction and
+    # results entries are pruned once, after a run.
+    cache_dir = _cache_dir(args)
+    if cache_dir is None:
+        return
+    _prune_cache(cache_dir / "results", "*.json", RESULTS_CACHE_MAX_BYTES)
+    _prune_cache(cache_dir, gf_scanner.EXTRACT_CACHE_GLOB, EXTRACT_CACHE_MAX_BYTES)
+
+
+def _repo_version(repo: dict) -> str | None:
+    """Identify a repo's default-branch contents without an API call.
+
+    GraphQL search results carry the head commit. REST results (anonymous
+    runs) only have pushed_at, which changes on every push, so the branch and
+    pushed_at stand in for it.
+    """
+    sha = repo.get("default_branch_sha")
+    if sha:
+        return sha
+    pushed_at = repo.get("pushed_at")
+    if not pushed_at:
+        return None
+    branch = repo.get("default_branch", "main")
+    return "p" + hashlib.sha256(f"{branch}\0{pushed_at}".encode()).hexdigest()[:16]
+
+
+def _results_path(args: argparse.Namespace, full_name: str, version: str) -> Path:
+    # Everything that changes a repo's records for a fixed commit goes into the key.
+    options = [
+        args.max_file_kb,
+        args.show_body,
+        sorted(_extensions(args) or ()),
+        sorted(gf_scanner.SKIP_DIRS),
+        gf_extractors.EXTRACTOR_VERSION,
+    ]
+    key = hashlib.sha256(json.dumps(options).encode()).hexdigest()[:16]
+    return Path(args.cache_dir) / "results" / f"{full_name.replace('/', '__')}-{version}-{key}.json"
+
+
+def _load_results(path: Path) -> list[dict] | None:
+    try:
+        funcs = _loads(path.read_bytes())
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return funcs if isinstance(funcs, list) else None
+
+
+def _download_repository(
     repo: dict,
-    zip_dir: Path,
     token: str | None,
+    keep_dir: Path | None,
+    zip_cache: Path | None,
+    scratch: Path,
+    version: str | None = None,
+) -> tuple[bytes | Path, bool, Path | None]:
+    """Fetch a repo's zipball as ``(archive, is_temp, cache_path)``.
+
+    ``is_temp`` is True when the archive is a spill file to delete. A fresh
+    download is not cached yet: ``cache_path`` is where to store it once it
+    has scanned cleanly. Download errors propagate.
+    """
+    full_name = repo["full_name"]
+    # Pin the download to the known commit so it matches its cache key.
+    ref = repo.get("default_branch_sha") or repo.get("default_branch", "main")
+    cached_path = None
+    if zip_cache is not None and version:
+        cached_path = zip_cache / f"{full_name.replace('/', '__')}-{version}.zip"
+
+    archive = _read_cached_zip(cached_path) if cached_path is not None else None
+    is_temp = False
+    if archive is None:
+        zip_url = gf_client.repo_zip_url(full_name, default_branch=ref)
+        spool = _ZipSpool(scratch)
+        try:
+            gf_client.download_file(zip_url, token=token, dest=spool)
+        except BaseException:
+            spool.discard()
+            raise
+        archive = spool.finish()
+        is_temp = spool.path is not None
+    else:
+        cached_path = None
+
+    if keep_dir is not None:
+        _write_archive(archive, _repo_zip_path(repo, keep_dir))
+    return archive, is_temp, cached_path
+
+
+def _clone_repository(
+    repo: dict, token: str | None, max_file_kb: int, scratch: Path
+) -> tuple[Path, bool]:
+    clone_dir = Path(tempfile.mkdtemp(dir=scratch))
+    try:
+        gf_client.partial_clone(repo["full_name"], clone_dir, max_file_kb, token=token)
+    except BaseException:
+        shutil.rmtree(clone_dir, ignore_errors=True)
+        raise
+    return clone_dir, True
+
+
+def _fetch_repository(
+    repo: dict, args: argparse.Namespace, keep_dir: Path | None, scratch: Path
+) -> _Fetched:
+    """Download or clone a repo, or return its cached results if its commit was already scanned.
+
+    A failed fetch is reported and yields an empty ``_Fetched``.
+    """
+    if args.git_clone:
+        try:
+            return _Fetched(*_clone_repository(repo, args.token, args.max_file_kb, scratch))
+        except (URLError, OSError) as exc:
+            _status(args, f"{repo['full_name']}: clone failed, skipping ({exc})")
+            return _Fetched()
+
+    zip_cache = _zip_cache_dir(args)
+    version = _repo_version(repo) if zip_cache is not None else None
+    results_path = None
+    if version:
+        results_path = _results_path(args, repo["full_name"], version)
+        # --keep-zips still needs the archive itself.
+        funcs = _load_results(results_path) if keep_dir is None else None
+        if funcs is not None:
+            return _Fetched(functions=funcs)
+
+    try:
+        archive, is_temp, zip_cache_path = _download_repository(
+            repo, args.token, keep_dir, zip_cache, scratch, version
+        )
+    except (HTTPError, URLError, OSError) as exc:
+        # e.g. ENOSPC while spilling to the temp dir.
+        _status(args, f"{repo['full_name']}: download failed, skipping ({exc})")
+        return _Fetched()
+    return _Fetched(archive, is_temp, results_path=results_path, zip_cache_path=zip_cache_path)
+
+
+def _finish_scan(fetched: _Fetched, funcs: list[dict] | None) -> None:
+    """Cache a cleanly scanned archive and its results, then drop the archive.
+
+    ``funcs`` is None when the scan failed; nothing is cached then, so a bad
+    download is fetched again next run.
+    """
+    if funcs is not None:
+        if fetched.zip_cache_path is not None:
+            _store_cached_zip(fetched.zip_cache_path, fetched.archive)
+        if fetched.results_path is not None:
+            _replace_file(fetched.results_path, _dumps(funcs).encode())
+    _discard_archive(fetched.archive, fetched.is_temp)
+
+
+def _scan_archive(
+    archive: bytes | Path,
+    full_name: str,
     max_file_kb: int,
     show_body: bool,
-    keep_zip: bool,
-) -> tuple[int, RepoResult, int]:
-    full_name = repo["full_name"]
-    branch = repo.get("default_branch", "main")
-    zip_url = gf_client.repo_zip_url(full_name, default_branch=branch)
-    zip_path = zip_dir / f"{full_name.replace('/', '__')}.zip"
+    cache_dir: Path | None,
+    members: list[str] | None = None,
+    extensions: frozenset[str] | None = None,
+) -> list[dict] | None:
+    """Scan a ZIP archive or git clone; None if it could not be read."""
+    if isinstance(archive, Path) and archive.is_dir():
+        try:
+            return gf_scanner.scan_git_repo(
+                archive,
+                full_name,
+                max_file_kb,
+                collect_body=show_body,
+                cache_dir=cache_dir,
+                extensions=extensions,
+            )
+        except (subprocess.CalledProcessError, OSError):
+            return None
 
     try:
-        gf_client.download_file(zip_url, token=token, dest=zip_path)
-        funcs = gf_scanner.scan_zip_archive(
-            zip_path,
+        return gf_scanner.scan_zip_archive(
+            _archive_file(archive),
             full_name,
             max_file_kb,
             collect_body=show_body,
+            cache_dir=cache_dir,
+            members=members,
+            extensions=extensions,
         )
-    except (HTTPError, URLError, zipfile.BadZipFile):
-        funcs = []
-    finally:
-        if zip_path.exists() and not keep_zip:
-            zip_path.unlink()
+    except gf_scanner.ARCHIVE_ERRORS:
+        return None
+
+
+def _member_chunks(
+    archive: bytes | Path,
+    max_file_kb: int,
+    parts: int,
+    extensions: frozenset[str] | None = None,
+) -> list[list[str] | None]:
+    """Split a large archive's files into ``parts`` scan tasks; ``[None]`` scans it whole."""
+    if isinstance(archive, Path) and archive.is_dir():
+        return [None]
+    try:
+        members = gf_scanner.candidate_members(_archive_file(archive), max_file_kb, extensions)
+    except gf_scanner.ARCHIVE_ERRORS:
+        # Scanned whole, where the same error makes the scan report failure.
+        return [None]
+    if parts < 2 or len(members) <= SPLIT_SCAN_MIN_FILES:
+        return [None]
+    size = -(-len(members) // parts)
+    return [members[i : i + size] for i in range(0, len(members), size)]
+
 
-    result = RepoResult(
+def _repo_result(repo: dict, funcs: list[dict]) -> RepoResult:
+    full_name = repo["full_name"]
+    return RepoResult(
         name=full_name.split("/", 1)[1],
         full_name=full_name,
         url=repo.get("html_url", ""),
@@ -237,7 +653,177 @@ def _scan_repository(
         functions=funcs,
     )
 
-    return idx, result, len(funcs)
+
+def _scan_repository(
+    idx: int,
+    repo: dict,
+    args: argparse.Namespace,
+    keep_dir: Path | None,
+    scratch: Path,
+) -> tuple[int, RepoResult]:
+    fetched = _fetch_repository(repo, args, keep_dir, scratch)
+    funcs = fetched.functions
+    if funcs is None:
+        funcs = []
+        if fetched.archive is not None:
+            scanned = _scan_archive(
+                fetched.archive,
+                repo["full_name"],
+                args.max_file_kb,
+                args.show_body,
+                _cache_dir(args),
+                extensions=_extensions(args),
+            )
+            _finish_scan(fetched, scanned)
+            funcs = scanned or []
+
+    return idx, _repo_result(repo, funcs)
+
+
+def _cache_dir(args: argparse.Namespace) -> Path | None:
+    return None if args.no_cache else Path(args.cache_dir)
+
+
+def _zip_cache_dir(args: argparse.Namespace) -> Path | None:
+    return None if args.no_cache else Path(args.cache_dir) / "zips"
+
+
+def _extensions(args: argparse.Namespace) -> frozenset[str] | None:
+    if not args.extensions:
+        return None
+    parts = (part.strip().lower() for part in args.extensions.split(","))
+    return frozenset(f".{part.lstrip('.')}" for part in parts if part)
+
+
+def _fetch_top_repositories(args: argparse.Namespace, top: int) -> tuple[list[dict], int]:
+    # GraphQL needs a token but returns each repo's head commit with the search.
+    if args.token:
+        try:
+            return gf_client.fetch_top_repositories_gql(args.query, top, token=args.token)
+        except URLError as exc:
+            # e.g. a token without GraphQL access, or its rate limit spent.
+            _status(args, f"GraphQL search failed ({exc}); falling back to the REST search API.")
+    return gf_client.fetch_top_repositories(args.query, top, token=args.token)
+
+
+def _scan_pool(workers: int) -> ProcessPoolExecutor:
+    # Scanning is CPU-bound (zip inflate, ast, regex), so it runs in processes to
+    # escape the GIL. fork is unsafe with the download threads already running.
+    method = "spawn" if sys.platform == "win32" else "forkserver"
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+
+
+def _iter_repository_results(
+    repos: list[dict],
+    start: int,
+    end: int,
+    zip_dir: Path,
+    args,
+    batch_starts: list[int] | None = None,
+) -> Iterator[tuple[int, RepoResult]]:
+    """Yield ``(1-based index, result)`` for ``repos[start:end]`` as each repo finishes.
+
+    ``batch_starts`` are the 0-based starts of the batches the span is split
+    into; repos are reordered only within their batch.
+    """
+    selected = repos[start:end]
+    keep_dir = zip_dir if args.keep_zips else None
+    download_workers = max(1, int(args.download_workers))
+    scan_workers = max(1, int(args.scan_workers))
+    with tempfile.TemporaryDirectory(prefix="gf-") as scratch_name:
+        scratch = Path(scratch_name)
+        if download_workers == 1 and scan_workers == 1:
+            for offset, repo in enumerate(selected, start=start + 1):
+                yield _scan_repository(offset, repo, args, keep_dir, scratch)
+        else:
+            yield from _iter_pooled_results(
+                selected, start, batch_starts or [start], download_workers, scan_workers, args, keep_dir, scratch
+            )
+
+
+def _iter_pooled_results(
+    selected: list[dict],
+    start: int,
+    batch_starts: list[int],
+    download_workers: int,
+    scan_workers: int,
+    args: argparse.Namespace,
+    keep_dir: Path | None,
+    scratch: Path,
+) -> Iterator[tuple[int, RepoResult]]:
+    # Downloads are limited by the download pool alone; new ones pause only
+    # while downloaded archives (up to SPOOL_MAX_BYTES each in memory) wait for
+    # the scan pool, so they cannot pile up faster than it drains them.
+    max_archives = 2 * scan_workers + ARCHIVE_SLACK
+    # Within each batch the largest repos (GitHub's "size", in KB) go first so
+    # one giant repo does not start late and dominate the batch's tail; batches
+    # keep their order and offsets keep the original rank.
+    queue = iter(
+        sorted(
+            enumerate(selected, start=start + 1),
+            key=lambda item: (bisect_right(batch_starts, item[0] - 1), -(item[1].get("size") or 0)),
+        )
+    )
+
+    with ThreadPoolExecutor(max_workers=download_workers) as io_pool, _scan_pool(scan_workers) as cpu_pool:
+        downloads: dict[Future, tuple[int, dict]] = {}
+        scans: dict[Future, tuple[int, int]] = {}
+        # Per repo: its fetch, each chunk's result (None if that chunk failed)
+        # and how many chunks are still scanning.
+        scanning: dict[int, tuple[dict, _Fetched, list[list[dict] | None]]] = {}
+        unscanned: dict[int, int] = {}
+        pending: set[Future] = set()
+
+        while True:
+            room = download_workers - len(downloads) if len(scanning) < max_archives else 0
+            for offset, repo in islice(queue, room):
+                download = io_pool.submit(_fetch_repository, repo, args, keep_dir, scratch)
+                downloads[download] = (offset, repo)
+                pending.add(download)
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in downloads:
+                    offset, repo = downloads.pop(future)
+                    fetched = future.result()
+                    if fetched.archive is not None:
+                        chunks = _member_chunks(fetched.archive, args.max_file_kb, scan_workers, _extensions(args))
+                        scanning[offset] = (repo, fetched, [None] * len(chunks))
+                        unscanned[offset] = len(chunks)
+                        for part, members in enumerate(chunks):
+                            scan = cpu_pool.submit(
+                                _scan_archive,
+                                fetched.archive,
+                                repo["full_name"],
+                                args.max_file_kb,
+                                args.show_body,
+                                _cache_dir(args),
+                                members,
+                                _extensions(args),
+                            )
+                            scans[scan] = (offset, part)
+                            pending.add(scan)
+                        continue
+                    funcs = fetched.functions or []
+                else:
+                    offset, part = scans.pop(future)
+                    repo, fetched, parts = scanning[offset]
+                    parts[part] = future.result()
+                    unscanned[offset] -= 1
+                    if unscanned[offset]:
+                        continue
+                    del scanning[offset], unscanned[offset]
+                    if any(chunk is None for chunk in parts):
+                        funcs = None
+                    else:
+                        funcs = [fn for chunk in parts for fn in chunk]
+                    # Caching the archive copies it; keep that off this loop.
+                    io_pool.submit(_finish_scan, fetched, funcs)
+                    funcs = funcs or []
+
+                yield offset, _repo_result(repo, funcs)
 
 
 def _process_repositories(
@@ -248,50 +834,14 @@ def _process_repositories(
     zip_dir: Path,
     args,
 ) -> tuple[int, int]:
-    selected = repos[start:end]
     processed = 0
     function_count = 0
-
-    workers = max(1, int(args.workers))
-    if workers == 1:
-        for offset, repo in enumerate(selected, start=start + 1):
-            idx, result, count = _scan_repository(
-                offset,
-                repo,
-                zip_dir,
-                args.token,
-                args.max_file_kb,
-            args.show_body,
-            args.keep_zips,
-            )
-            print(f"[{idx}/{total}] done")
-            _print_functions(result.full_name, result.functions, args.show_body)
-            processed += 1
-            function_count += count
-        return processed, function_count
-
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        futures = {
-            executor.submit(
-                _scan_repository,
-                offset,
-                repo,
-                zip_dir,
-                args.token,
-                args.max_file_kb,
-                args.show_body,
-                args.keep_zips,
-            ): offset
-            for offset, repo in enumerate(selected, start=start + 1)
-        }
-
-        for future in as_completed(futures):
-            idx, result, count = future.result()
-            print(f"[{idx}/{total}] done")
-            _print_functions(result.full_name, result.functions, args.show_body)
-            processed += 1
-            function_count += count
-
+    seen = None if args.no_dedup else {}
+    for offset, result in _iter_repository_results(repos, start, end, zip_dir, args):
+        _status(args, f"[{offset}/{total}] done")
+        _print_functions(result.full_name, result.functions, args.show_body, args.json, seen)
+        processed += 1
+        function_count += len(result.functions)
     return processed, function_count
 
 
@@ -341,11 +891,34 @@ def main() -> None:
         action="store_true",
         help="Disable function body output in terminal (default)",
     )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        default=False,
+        help="Print one JSON object per function (NDJSON) on stdout; progress goes to stderr",
+    )
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=None,
+        help=(
+            f"Concurrent repo downloads (default {DOWNLOAD_WORKERS}). Downloads are network-bound, "
+            "so this is independent of the CPU count; throughput usually levels off around 20-30. "
+            f"New downloads pause while 2 x --scan-workers + {ARCHIVE_SLACK} downloaded archives "
+            "are waiting to be scanned"
+        ),
+    )
+    parser.add_argument(
+        "--scan-workers",
+        type=int,
+        default=None,
+        help="Scan processes (default: CPU count)",
+    )
     parser.add_argument(
         "--workers",
         type=int,
-        default=12,
-        help="Parallel workers for repo download/scan",
+        default=None,
+        help="Deprecated: sets both --download-workers and --scan-workers (the latter capped at the CPU count)",
     )
     parser.add_argument(
         "--keep-zips",
@@ -353,6 +926,38 @@ def main() -> None:
         default=False,
         help="Keep downloaded repo ZIP files in the repo.zip folder",
     )
+    parser.add_argument(
+        "--extensions",
+        default=None,
+        help="Comma-separated file extensions to scan, e.g. .py,.go (default: every supported extension)",
+    )
+    parser.add_argument(
+        "--git-clone",
+        action="store_true",
+        default=False,
+        help="Fetch repos with a shallow partial git clone (blobs over --max-file-kb stay on the server) instead of a ZIP",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=str(gf_scanner.EXTRACT_CACHE_DIR),
+        help=(
+            "Directory for cached per-file extraction results and repo ZIPs (keyed by commit SHA "
+            "with --token, otherwise by the repo's last push time). Least recently used entries "
+            "are pruned past 4 GiB of ZIPs and 1 GiB each of extraction and repo results"
+        ),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Disable the on-disk extraction and ZIP caches",
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        default=False,
+        help="Print every function body, even ones already printed for another function",
+    )
     parser.add_argument(
         "--parallel-terminals",
         action="store_true",
@@ -383,6 +988,19 @@ def main() -> None:
     args = parser.parse_args()
 
     args.show_body = False if args.no_body else args.show_body
+    cpu_count = os.cpu_count() or 1
+    if args.download_workers is None:
+        args.download_workers = DOWNLOAD_WORKERS if args.workers is None else args.workers
+    if args.scan_workers is None:
+        args.scan_workers = cpu_count if args.workers is None else min(args.workers, cpu_count)
+    unsupported = sorted((_extensions(args) or frozenset()) - gf_extractors.EXTRACTORS.keys())
+    if unsupported:
+        parser.error(f"unsupported --extensions: {', '.join(unsupported)}")
+    if args.json and args.parallel_terminals:
+        # Batch processes would share stdout and interleave NDJSON records.
+        parser.error("--json cannot be combined with --parallel-terminals")
+    if args.git_clone and shutil.which("git") is None:
+        raise SystemExit("--git-clone requires git on PATH")
 
     if args.subset_start is not None and args.subset_end is not None:
         _, _ = _run_subset(args)
@@ -391,14 +1009,16 @@ def main() -> None:
     requested_top = max(1, min(args.top, 100))
     workdir = Path(args.workdir)
     zip_dir = workdir / "repo.zip"
-    zip_dir.mkdir(parents=True, exist_ok=True)
+    if args.keep_zips:
+        zip_dir.mkdir(parents=True, exist_ok=True)
 
-    repos, total_count = gf_client.fetch_top_repositories(args.query, requested_top, token=args.token)
+    repos, total_count = _fetch_top_repositories(args, requested_top)
     if not repos:
         raise SystemExit("No repositories returned. Check query and API token/rate limits.")
 
     if total_count and total_count < requested_top:
-        print(
+        _status(
+            args,
             f"Warning: query '{args.query}' matches only {total_count} repositories. "
             f"Returning {len(repos)} out of requested {requested_top}."
         )
@@ -414,11 +1034,12 @@ def main() -> None:
 
     if args.parallel_terminals:
         processes = []
-        print(
-            f"Starting {len(ranges)} terminal instance(s) for batches using app '{args.terminal_app}'."
+        _status(
+            args,
+            f"Starting {len(ranges)} terminal instance(s) for batches using app '{args.terminal_app}'.",
         )
         for batch_no, (start, end) in enumerate(ranges, start=1):
-            print(f"[batch {batch_no}/{len(ranges)}] spawning repos {start + 1}-{end}")
+            _status(args, f"[batch {batch_no}/{len(ranges)}] spawning repos {start + 1}-{end}")
             proc = _launch_terminal_batch(batch_no, len(ranges), start, end, args)
             processes.append(proc)
 
@@ -426,29 +1047,52 @@ def main() -> None:
             stdout, stderr = process.communicate()
             return_code = process.returncode
             if return_code != 0:
-                print(f"One batch command failed with status {return_code}.")
+                _status(args, f"One batch command failed with status {return_code}.")
                 if stdout:
-                    print(stdout.strip())
+                    _status(args, stdout.strip())
                 if stderr:
-                    print(stderr.strip())
-        print(f"Spawned and waited for {len(processes)} batch process(es).")
+                    _status(args, stderr.strip())
+        _status(args, f"Spawned and waited for {len(processes)} batch process(es).")
         return
 
+    # All batches share one download/scan pipeline, so the next batch's
+    # downloads start while the current batch is still scanning. Results of a
+    # later batch are held back until every earlier batch has been printed and
+    # summarised, so output stays in batch order.
     stats = defaultdict(int)
-    for batch_no, (start, end) in enumerate(ranges, start=1):
-        print(f"[batch {batch_no}/{len(ranges)}] repos {start + 1}-{end}")
-        batch_processed, batch_functions = _process_repositories(
-            repos,
-            start,
-            end,
-            len(repos),
-            zip_dir,
-            args,
-        )
-        stats["repositories"] += batch_processed
-        stats["functions"] += batch_functions
+    batch_starts = [start for start, _ in ranges]
+    remaining = [end - start for start, end in ranges]
+    batch_stats = [[0, 0] for _ in ranges]
+    held: list[list[tuple[int, RepoResult]]] = [[] for _ in ranges]
+    current = 0
+    seen = None if args.no_dedup else {}
+    for offset, result in _iter_repository_results(
+        repos, ranges[0][0], ranges[-1][1], zip_dir, args, batch_starts
+    ):
+        held[bisect_right(batch_starts, offset - 1) - 1].append((offset, result))
+        while current < len(ranges):
+            for idx, done in held[current]:
+                _status(args, f"[{idx}/{len(repos)}] done")
+                _print_functions(done.full_name, done.functions, args.show_body, args.json, seen)
+                stats["repositories"] += 1
+                stats["functions"] += len(done.functions)
+                batch_stats[current][0] += 1
+                batch_stats[current][1] += len(done.functions)
+                remaining[current] -= 1
+            held[current].clear()
+            if remaining[current]:
+                break
+            start, end = ranges[current]
+            repositories, functions = batch_stats[current]
+            _status(
+                args,
+                f"[batch {current + 1}/{len(ranges)} done] repos {start + 1}-{end}: "
+                f"Printed {functions} functions across {repositories} repos.",
+            )
+            current += 1
 
-    print(f"Done. Printed {stats['functions']} functions across {stats['repositories']} repos.")
+    _prune_caches(args)
+    _status(args, f"Done. Printed {stats['functions']} functions across {stats['repositories']} repos.")
 
 
 if __name__ == "__main__":